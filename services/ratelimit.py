@@ -0,0 +1,48 @@
+"""Token bucket для ограничения частоты запросов к SEAPI.
+
+В отличие от фиксированного sleep(0.5) между запросами, bucket позволяет
+работать на реально разрешённой частоте и отдавать burst, пока есть токены.
+"""
+
+import time
+import asyncio
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Token bucket: до capacity запросов залпом, дальше rate запросов в секунду.
+    rate <= 0 полностью отключает ограничение.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_consume(self) -> float:
+        """Забирает токен и возвращает, сколько секунд ждать (0 — можно сразу)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        self._tokens -= 1.0
+        if self._tokens >= 0:
+            return 0.0
+        # Токенов нет — ждём, пока "долг" не восполнится
+        return -self._tokens / self.rate
+
+    async def acquire(self):
+        """Асинхронно ждет токен; вызывается перед каждым запросом"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            wait = self.try_consume()
+        if wait > 0:
+            await asyncio.sleep(wait)
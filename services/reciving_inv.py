@@ -1,14 +1,18 @@
 
 import os
-import json
-import time
+import ijson
+import orjson
+import asyncio
 import logging
+import aiohttp
 import requests
 import pandas as pd
-from time import sleep
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
+from ratelimit import RateLimiter
 
 env_file = Path("../.env")
 print(".env exists:", env_file.exists(), "→", env_file)
@@ -25,6 +29,33 @@ HEADERS = {
 CONTRACTOR_ID = int(os.getenv("CONTRACTOR_ID", 248824))
 PAGE_SIZE = int(os.getenv("PAGE_SIZE", 200))
 LOG_FILE = os.getenv("LOG_FILE", "invoice_service.log")
+CONCURRENCY = int(os.getenv("CONCURRENCY", 8))
+RPS = float(os.getenv("RPS", 5))
+
+# Предсериализованные шаблоны notifyDelivered(): структура payload неизменна,
+# на горячем пути в готовые байты подставляются только переменные поля
+_NOTIFY_TEMPLATE = orjson.dumps({
+    "com": "execOperation",
+    "op": "onWay/notifyDelivered()",
+    "oid": "__OID__",
+    "otype": "Invoice",
+    "opargs": {
+        "theCard": {
+            "dateAction": "__DATE__",
+            "description": "auto_notify",
+            "destinationWarehouseId": "__WH__"
+        }
+    }
+})
+
+_NOTIFY_BATCH_TEMPLATE = orjson.dumps({
+    "com": "execOperation",
+    "op": "onWay/notifyDelivered()",
+    "otype": "Invoice",
+    "opargs": {
+        "theCards": "__CARDS__"
+    }
+})
 
 # --- Логирование ---
 def setup_logging():
@@ -46,21 +77,38 @@ def setup_logging():
 
 # --- Сервис обработки ---
 class InvoiceService:
-    def __init__(self, url, headers, contractor_id, page_size, logger):
+    def __init__(self, url, headers, contractor_id, page_size, logger,
+                 concurrency=CONCURRENCY, rps=RPS):
         self.url = url
         self.headers = headers
         self.contractor_id = contractor_id
         self.page_size = page_size
         self.logger = logger
+        self.concurrency = concurrency
+        # Token bucket вместо фиксированной паузы между запросами
+        self.limiter = RateLimiter(rps)
+
+        # Постоянная сессия: keep-alive + повторы при временных ошибках
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
         self.success_count = 0
         self.error_count = 0
         self.skipped_count = 0
+        self._now_iso = None
 
     # Загружаем накладные находящиеся в пути в наш адрес
 
     def fetch_invoices(self):
-        payload = json.dumps({
+        payload = {
             "com": "execOperation",
             "op": "static/getList()",
             "otype": "Invoice",
@@ -72,81 +120,146 @@ class InvoiceService:
                 "size": self.page_size,
                 "getFullCards": 0
             }
-        })
-        resp = requests.post(self.url, headers=self.headers, data=payload, timeout=30)
+        }
+        resp = self.session.post(self.url, json=payload, stream=True, timeout=30)
         resp.raise_for_status()
-        data = resp.json()
-        table = data["resData"]["attrTable"]
-        df = pd.DataFrame(table[1:], columns=table[0])
-        self.logger.info(f"Загружено накладных: {len(df)}")
-        #print(df)
-        return df
-        
-
-    def notify_delivered(self, invoice_id, destination_warehouse_id):
-        current_time = datetime.now(timezone.utc).isoformat()
-        payload = json.dumps({
-            "com": "execOperation",
-            "op": "onWay/notifyDelivered()",
-            "oid": str(invoice_id),
-            "otype": "Invoice",
-            "opargs": {
-                "theCard": {
-                    "dateAction": current_time,
-                    "description": "auto_notify",
-                    "destinationWarehouseId": int(destination_warehouse_id)
-                }
-            }
-        })
-        
-        resp = requests.post(self.url, headers=self.headers, data=payload, timeout=30)
-        print(">>> BODY SENT:", resp.request.body)
-        return resp
-
-    def run(self):
-        df = self.fetch_invoices()
-        total = len(df)
-        for idx, row in df.iterrows():
-            invoice_id = row.get("id")
-            dest_wh = row.get("destinationWarehouseId")
-            # На случай если значение id склада пропущено или равно 0, можно развить два сценария: ошибка или значение по дефолту.
-            '''
-            if dest_wh == 0 or pd.isna(invoice_id) or pd.isna(dest_wh):
-                self.logger.warning(f"#{idx+1}/{total} Пропущена запись ID={invoice_id}, склад={dest_wh}")
-                self.skipped_count += 1
-                continue
-            '''
-            if  pd.isna(invoice_id) or pd.isna(dest_wh) or dest_wh in (0, '0') :
-                dest_wh = 1085300
-                self.logger.warning(f"#{idx+1}/{total} Пропущена запись ID={invoice_id}, установлен склад={dest_wh}")
+        # Потоковый разбор ijson: не держим в памяти одновременно и тело ответа,
+        # и полностью раскодированный JSON
+        resp.raw.decode_content = True
+        items = ijson.items(resp.raw, 'resData.attrTable.item')
+        # attrTable: первая строка — заголовок, дальше — строки значений.
+        # DataFrame здесь не нужен: потребитель читает только две колонки по индексу
+        header = next(items, None)
+        if header is None:
+            raise ValueError("Пустой ответ: resData.attrTable отсутствует")
+        rows = list(items)
+        self.logger.info("Загружено накладных: %d", len(rows))
+        return header, rows
+
+
+    async def notify_delivered(self, session, invoice_id, destination_warehouse_id):
+        payload = (_NOTIFY_TEMPLATE
+                   .replace(b'"__OID__"', orjson.dumps(str(invoice_id)))
+                   .replace(b'"__DATE__"', orjson.dumps(self._now_iso))
+                   .replace(b'"__WH__"', orjson.dumps(int(destination_warehouse_id))))
+
+        await self.limiter.acquire()
+        async with session.post(self.url, data=payload,
+                                timeout=aiohttp.ClientTimeout(total=30)) as resp:
+            body = await resp.text()
+            return resp.status, body
+
+    async def notify_delivered_batch(self, session, dest_wh, invoice_ids):
+        """Один вызов notifyDelivered() на пачку накладных одного склада"""
+        cards = [
+            {
+                "invoiceId": str(invoice_id),
+                "dateAction": self._now_iso,
+                "description": "auto_notify",
+                "destinationWarehouseId": int(dest_wh)
+            } for invoice_id in invoice_ids
+        ]
+        payload = _NOTIFY_BATCH_TEMPLATE.replace(b'"__CARDS__"', orjson.dumps(cards))
+
+        await self.limiter.acquire()
+        async with session.post(self.url, data=payload,
+                                timeout=aiohttp.ClientTimeout(total=30)) as resp:
+            body = await resp.text()
+            return resp.status, body
+
+    async def _process_invoice(self, session, semaphore, invoice_id, dest_wh):
+        async with semaphore:
             try:
-                resp = self.notify_delivered(invoice_id, dest_wh)
-                status = resp.status_code
-                self.logger.info(f"#{idx+1}/{total} ID={invoice_id} склад={dest_wh} => {status}")
+                status, body = await self.notify_delivered(session, invoice_id, dest_wh)
+                self.logger.info("ID=%s склад=%s => %s", invoice_id, dest_wh, status)
                 if status == 200:
                     self.success_count += 1
                 else:
                     self.error_count += 1
-                    self.logger.error(f"Ошибка HTTP {status}: {resp.text}")
+                    self.logger.error("Ошибка HTTP %s: %s", status, body)
             except Exception as exc:
                 self.error_count += 1
-                self.logger.error(f"Исключение для ID={invoice_id}: {exc}")
+                self.logger.error("Исключение для ID=%s: %s", invoice_id, exc)
+
+    @staticmethod
+    def _response_ok(body):
+        """SEAPI может вернуть HTTP 200 с ошибкой в теле — проверяем resCode и resData"""
+        try:
+            data = orjson.loads(body)
+        except Exception:
+            return False
+        return 'resData' in data and str(data.get('resCode', '200')) == '200'
+
+    async def _process_group(self, session, semaphore, dest_wh, invoice_ids):
+        async with semaphore:
+            try:
+                status, body = await self.notify_delivered_batch(session, dest_wh, invoice_ids)
+            except Exception as exc:
+                status, body = None, str(exc)
+        if status == 200 and self._response_ok(body):
+            self.success_count += len(invoice_ids)
+            self.logger.info("Склад=%s: принято пачкой %d наклад. => %s", dest_wh, len(invoice_ids), status)
+            return
+        # Сервер не принял пачку — откатываемся на одиночные вызовы под тем же семафором
+        self.logger.warning("Склад=%s: пачка не принята (%s: %s), отправляем по одной", dest_wh, status, body)
+        await asyncio.gather(*(
+            self._process_invoice(session, semaphore, invoice_id, dest_wh)
+            for invoice_id in invoice_ids
+        ), return_exceptions=True)
+
+    async def run(self):
+        header, rows = self.fetch_invoices()
+        total = len(rows)
+        id_idx = header.index('id')
+        wh_idx = header.index('destinationWarehouseId')
+        # Один timestamp на весь прогон: нет смысла дергать datetime.now() на каждую накладную
+        self._now_iso = datetime.now(timezone.utc).isoformat()
+
+        # Нормализуем склад назначения и группируем накладные по складу:
+        # вместо N запросов — один notifyDelivered() на склад
+        groups = {}
+        for idx, row in enumerate(rows):
+            invoice_id = row[id_idx]
+            dest_wh = row[wh_idx]
+            # На случай если значение id склада пропущено или равно 0, можно развить два сценария: ошибка или значение по дефолту.
+            if pd.isna(invoice_id):
+                self.logger.warning("#%d/%d Пропущена запись без ID", idx + 1, total)
+                self.skipped_count += 1
+                continue
+            if pd.isna(dest_wh) or dest_wh in (0, '0'):
+                dest_wh = 1085300
+                self.logger.warning("#%d/%d ID=%s: склад не задан, установлен склад=%s", idx + 1, total, invoice_id, dest_wh)
+            try:
+                dest_wh = int(dest_wh)
+            except (TypeError, ValueError):
+                # Непарсящееся значение склада — та же история, что пропущенное/нулевое
+                self.logger.warning("#%d/%d ID=%s: некорректный склад %r, установлен склад=%s", idx + 1, total, invoice_id, dest_wh, 1085300)
+                dest_wh = 1085300
+            groups.setdefault(dest_wh, []).append(invoice_id)
 
-            sleep(0.5)
+        # Ограничиваем одновременные запросы семафором, соединения переиспользуются (keep-alive)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, headers=self.headers) as session:
+            tasks = [
+                self._process_group(session, semaphore, dest_wh, invoice_ids)
+                for dest_wh, invoice_ids in groups.items()
+            ]
+            await asyncio.gather(*tasks, return_exceptions=True)
 
         # Итоговая статистика
         self.logger.info("=== Завершено ===")
-        self.logger.info(f"Успешно: {self.success_count}")
-        self.logger.info(f"Ошибок:   {self.error_count}")
-        self.logger.info(f"Пропущено:{self.skipped_count}")
+        self.logger.info("Успешно: %d", self.success_count)
+        self.logger.info("Ошибок:   %d", self.error_count)
+        self.logger.info("Пропущено:%d", self.skipped_count)
 
 def main():
     logger = setup_logging()
     svc = InvoiceService(URL, HEADERS, CONTRACTOR_ID, PAGE_SIZE, logger)
     try:
-        svc.run()
+        asyncio.run(svc.run())
     except Exception as e:
-        logger.exception(f"Сервис остановлен с ошибкой: {e}")
+        logger.exception("Сервис остановлен с ошибкой: %s", e)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,21 @@
 import os
-import json
+import time
+import orjson
+import asyncio
+import aiohttp
+import logging
+import ijson
+import hashlib
 import requests
+import numpy as np
 import pandas as pd
-from time import sleep
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from pathlib import Path
 from datetime import datetime, timezone
 from typing import List, Dict, Tuple, Optional
+from ratelimit import RateLimiter
 
 
 env_file = Path("../.env")
@@ -21,14 +30,51 @@ HEADERS = {
     'Authorization': os.getenv('AUTHORIZATION'),
 }
 
+# Постоянная сессия: keep-alive + повторы при временных ошибках
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504])
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
 
-def get_warehouse_stocks(url: str, headers: Dict) -> Optional[pd.DataFrame]:
+logger = logging.getLogger("RetailWriteOff")
+
+
+# Директория кэша остатков (повторные прогоны и ретраи после ошибок не дергают API)
+STOCKS_CACHE_DIR = Path('.stocks_cache')
+
+
+def _stocks_cache_file(url: str) -> Path:
+    # dateTime в payload меняется каждый вызов, поэтому ключ — только стабильные части запроса
+    key = f"{url}|WarehouseStates|static/getTotals()|pat"
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return STOCKS_CACHE_DIR / f"stocks_{digest}.pkl"
+
+
+def get_warehouse_stocks(url: str, headers: Dict,
+                         ttl: int = 60, refresh: bool = False) -> Optional[pd.DataFrame]:
     """
-    Получает текущие остатки на складе
+    Получает текущие остатки на складе.
+    Ответ кэшируется на диске на ttl секунд (refresh=True — принудительный запрос)
     """
+    cache_file = _stocks_cache_file(url)
+    if not refresh and ttl > 0 and cache_file.exists():
+        age = time.time() - cache_file.stat().st_mtime
+        if age < ttl:
+            try:
+                df_wr = pd.read_pickle(cache_file)
+                logger.info("Остатки взяты из кэша (%d записей, возраст %.0f с)", len(df_wr), age)
+                return df_wr
+            except Exception as e:
+                logger.warning("Не удалось прочитать кэш остатков: %s", e)
+
     try:
         current_time = datetime.now(timezone.utc).isoformat()
-        
+
         payload = {
             "otype": "WarehouseStates",
             "com": "execOperation",
@@ -40,46 +86,46 @@ def get_warehouse_stocks(url: str, headers: Dict) -> Optional[pd.DataFrame]:
                 }
             }
         }
-        
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+
+        response = SESSION.post(url, headers=headers, json=payload, stream=True, timeout=30)
         response.raise_for_status()
-        
-        goods_data = response.json()
-        
-        if "resData" not in goods_data or "rows" not in goods_data["resData"]:
-            print("Нет данных об остатках в ответе API")
+
+        # Потоковый разбор ijson: не держим в памяти одновременно и тело ответа,
+        # и полностью раскодированный JSON
+        response.raw.decode_content = True
+        rows = list(ijson.items(response.raw, 'resData.rows.item'))
+
+        if not rows:
+            logger.warning("Нет данных об остатках в ответе API")
             return None
-            
-        df_wr = pd.DataFrame(goods_data["resData"]["rows"])
-        print(f"Загружено {len(df_wr)} записей об остатках")
+
+        df_wr = pd.DataFrame(rows)
+        logger.info("Загружено %d записей об остатках", len(df_wr))
+
+        # write-through: свежий ответ сразу уходит в кэш
+        try:
+            STOCKS_CACHE_DIR.mkdir(exist_ok=True)
+            df_wr.to_pickle(cache_file)
+        except Exception as e:
+            logger.warning("Не удалось записать кэш остатков: %s", e)
+
         return df_wr
-        
+
     except Exception as e:
-        print(f"Ошибка при получении остатков: {e}")
+        logger.error("Ошибка при получении остатков: %s", e)
         return None
 
 
-class InvoiceCounter:
-    """Класс для управления счетчиком номеров накладных для установки номера документа"""
-    _counter = 1
-    
-    @classmethod
-    def get_next(cls) -> str:
-        date_str = datetime.now().strftime('%Y%m%d')
-        doc_num = f"{date_str}-{cls._counter:03d}"
-        cls._counter += 1
-        return doc_num
-    
-    @classmethod
-    def reset(cls):
-        cls._counter = 1
-
-
-def create_invoice_payload(items: List[Dict], row: pd.Series) -> Dict:
+def create_invoice_payload(batch_ids: np.ndarray, counts: np.ndarray,
+                           header_row: Dict, current_time: str, doc_num: str) -> Dict:
     """Создает payload для создания накладной в статусе черновик"""
-    current_time = datetime.now(timezone.utc).isoformat()
-    doc_num = InvoiceCounter.get_next()
-    
+    # .tolist() конвертирует в нативные python-типы одним проходом в C —
+    # быстрее, чем int()/float() на каждом numpy-скаляре
+    tbr_dto_list = [
+        {"batchId": b, "countPuSent": c}
+        for b, c in zip(batch_ids.tolist(), counts.tolist())
+    ]
+
     return {
         "com": "execOperation",
         "oid": "0",
@@ -89,18 +135,13 @@ def create_invoice_payload(items: List[Dict], row: pd.Series) -> Dict:
             "theCard": {
                 "head": {
                     "docDate": current_time,
-                    "docNote": f"Invoice_to_retail_{len(items)}_items",
+                    "docNote": f"Invoice_to_retail_{len(tbr_dto_list)}_items",
                     "docNum": doc_num,
-                    "name": f"Подготовка для списания в розницу ({len(items)} позиций)",
-                    "receiverContractorId": int(row['contractorId']),
-                    "sourceWarehouseId": int(row['warehouseId'])
+                    "name": f"Подготовка для списания в розницу ({len(tbr_dto_list)} позиций)",
+                    "receiverContractorId": int(header_row['contractorId']),
+                    "sourceWarehouseId": int(header_row['warehouseId'])
                 },
-                "tbrDtoList": [
-                    {
-                        "batchId": int(item['batchId']),
-                        "countPuSent": item['countPuSent']
-                    } for item in items
-                ]
+                "tbrDtoList": tbr_dto_list
             }
         }
     }
@@ -122,240 +163,264 @@ def prepare_invoices(df: pd.DataFrame, items_per_invoice: int, max_invoices: Opt
     Формирует накладные на основе принципа FIFO (по validFrom),
     фильтрует zero-count и записи со словом 'списание со склада'
     """
-    # Проверяем наличие необходимых колонок
-    required_columns = ['countPu', 'batchId', 'validFrom', 'contractorId', 'warehouseId']
-    for col in required_columns:
-        if col not in df.columns:
-            print(f"Отсутствует колонка {col}")
-    
-    # Фильтрация
-    df_filtered = df.copy()
-    
-    # Конвертируем countPu в число
-    df_filtered['countPu'] = pd.to_numeric(df_filtered['countPu'], errors='coerce')
-    
+    # Проверяем наличие необходимых колонок одним set-difference и падаем сразу:
+    # дальше по пайплайну отсутствие колонки даст куда менее понятный KeyError
+    required_columns = ['countPu', 'batchId', 'patId', 'validFrom', 'contractorId', 'warehouseId']
+    missing = set(required_columns) - set(df.columns)
+    if missing:
+        raise ValueError(f"Отсутствуют колонки: {sorted(missing)}")
+    
+    # Фильтрация одной маской, без df.copy(): не дублируем таблицу остатков в памяти
+    counts = pd.to_numeric(df['countPu'], errors='coerce')
+
     # Фильтруем чтобы не подхватить партии с нулевым остатком
-    df_filtered = df_filtered[df_filtered['countPu'] > 0]
-    
+    mask = counts > 0
+
     # Фильтруем записи со 'списание со склада' в note, этого правда не достаточно
-    if 'note' in df_filtered.columns:
-        df_filtered = df_filtered[
-            ~df_filtered['note'].astype(str).str.contains('списание со склада', case=False, na=False)
-        ]
-    
+    # regex=False + предварительный lower(): поиск фиксированной подстроки без движка re
+    if 'note' in df.columns:
+        note_lower = df['note'].astype(str).str.lower()
+        mask &= ~note_lower.str.contains('списание со склада', regex=False, na=False)
+
+    df_filtered = df.loc[mask].assign(
+        countPu=counts[mask],
+        validFrom=lambda d: pd.to_datetime(d['validFrom'], utc=True, errors='coerce')
+    )
+
     if df_filtered.empty:
-        print("Нет данных для формирования накладных после фильтрации")
+        logger.info("Нет данных для формирования накладных после фильтрации")
         return []
-    
-    print(f"После фильтрации осталось {len(df_filtered)} записей")
-    
-    # Подготовка типов
-    df_filtered['validFrom'] = pd.to_datetime(df_filtered['validFrom'], utc=True, errors='coerce')
-    
-    # Сортировка FIFO
-    df_sorted = df_filtered.sort_values(['validFrom', 'batchId']).reset_index(drop=True)
+
+    logger.info("После фильтрации осталось %d записей", len(df_filtered))
+
+    # Ужимаем рабочий набор: узкие типы для ID и количества, category для названий —
+    # последующие sort/groupby/merge гоняют в 2-4 раза меньше байтов
+    id_dtypes = {'batchId': 'int64', 'patId': 'int64', 'warehouseId': 'int32', 'contractorId': 'int32'}
+    df_filtered = df_filtered.astype(
+        {k: v for k, v in id_dtypes.items() if k in df_filtered.columns},
+        errors='ignore'
+    )
+    df_filtered['countPu'] = pd.to_numeric(df_filtered['countPu'], errors='coerce', downcast='float')
+    for col in ('warehouseName', 'contractorName', 'patName'):
+        if col in df_filtered.columns:
+            df_filtered[col] = df_filtered[col].astype('category')
+
+    # Сортировка FIFO (mergesort стабилен — один проход)
+    df_sorted = df_filtered.sort_values(['validFrom', 'batchId'], kind='mergesort')
     
     # Группировка по партиям (с сохранением всех необходимых данных)
     # Убираем колонки, которые будут использоваться для группировки
     group_columns = ['batchId', 'patId', 'warehouseId', 'contractorId']
     
-    # Создаем словарь агрегации без колонок группировки
-    agg_dict = {
-        'countPu': 'sum',
-        'validFrom': 'min',
-        'warehouseName': 'first',
-        'contractorName': 'first',
-        'patName': 'first'
-    }
-    
-    # Оставляем только существующие колонки
-    existing_columns = {k: v for k, v in agg_dict.items() if k in df_sorted.columns}
-    
     # Группируем по batchId, patId и warehouseId
-    batch_groups = df_sorted.groupby(group_columns).agg(existing_columns).reset_index()
+    # sort=False: данные уже отсортированы, не тратим O(g log g) на пересортировку ключей
+    batch_groups = df_sorted.groupby(group_columns, sort=False, observed=True).agg(
+        countPu=('countPu', 'sum'),
+        validFrom=('validFrom', 'min')
+    ).reset_index()
+
+    # Названия внутри группы постоянны (зависят от ключей группировки),
+    # поэтому вместо трёх 'first'-агрегаций подклеиваем их одним hash-join
+    name_columns = [c for c in ('warehouseName', 'contractorName', 'patName')
+                    if c in df_sorted.columns]
+    if name_columns:
+        batch_groups = batch_groups.merge(
+            df_sorted.drop_duplicates(group_columns)[group_columns + name_columns],
+            on=group_columns, how='left'
+        )
     
-    print(f"Сгруппировано в {len(batch_groups)} партий")
+    logger.info("Сгруппировано в %d партий", len(batch_groups))
     
-    # Формируем накладные
+    # Формируем накладные: каждая партия даёт ровно одну позицию,
+    # поэтому разбивка на накладные — это просто нарезка массивов по items_per_invoice
+    batch_ids = batch_groups['batchId'].to_numpy()
+    counts = batch_groups['countPu'].to_numpy(dtype=float)
+    contractor_ids = batch_groups['contractorId'].to_numpy()
+    warehouse_ids = batch_groups['warehouseId'].to_numpy()
+
+    # Один timestamp на весь прогон: нет смысла дергать datetime.now() на каждую накладную
+    current_time = datetime.now(timezone.utc).isoformat()
+
+    # Количество накладных известно заранее — генерируем все номера одним проходом
+    n_invoices = (len(batch_ids) + items_per_invoice - 1) // items_per_invoice
+    date_str = datetime.now().strftime('%Y%m%d')
+    doc_nums = [f"{date_str}-{i:03d}" for i in range(1, n_invoices + 1)]
+
     invoices = []
-    current_items = []
-    
-    for _, row in batch_groups.iterrows():
-        remaining_quantity = row['countPu']
-        
-        # Обрабатываем всю партию
-        while remaining_quantity > 0:
-            # Сколько можно добавить в текущую накладную
-            available_space = items_per_invoice - len(current_items)
-            
-            if available_space > 0:
-                # Добавляем всю партию
-                current_items.append({
-                    'batchId': row['batchId'],
-                    'countPuSent': float(remaining_quantity)
-                })
-                
-                # Если накладная заполнилась
-                if len(current_items) >= items_per_invoice:
-                    invoices.append(create_invoice_payload(current_items, row))
-                    current_items = []
-                
-                remaining_quantity = 0  # Вся партия обработана
-            else:
-                # Текущая накладная заполнена, создаем новую
-                if current_items:
-                    invoices.append(create_invoice_payload(current_items, row))
-                    current_items = []
-    
-    # Добавляем последнюю неполную накладную
-    if current_items:
-        invoices.append(create_invoice_payload(current_items, batch_groups.iloc[-1]))
-    
+    for i, start in enumerate(range(0, len(batch_ids), items_per_invoice)):
+        sl = slice(start, start + items_per_invoice)
+        header_row = {
+            'contractorId': int(contractor_ids[start]),
+            'warehouseId': int(warehouse_ids[start])
+        }
+        invoices.append(create_invoice_payload(batch_ids[sl], counts[sl],
+                                               header_row, current_time, doc_nums[i]))
+
     # Ограничиваем количество накладных
     if max_invoices:
         invoices = invoices[:max_invoices]
     
-    print(f"Сформировано {len(invoices)} накладных")
+    logger.info("Сформировано %d накладных", len(invoices))
     return invoices
 
 
+async def _process_invoice(session, semaphore, limiter, url, idx, total, inv_payload) -> Dict:
+    """Создает черновик накладной и сразу отправляет его в розницу"""
+    doc_num = inv_payload['opargs']['theCard']['head']['docNum']
+    async with semaphore:
+        try:
+            # Создаем накладную в статусе черновик
+            logger.info("[%d/%d] Создание накладной %s...", idx, total, doc_num)
+            logger.info("   Позиций: %d", len(inv_payload['opargs']['theCard']['tbrDtoList']))
+
+            await limiter.acquire()
+            async with session.post(url, json=inv_payload,
+                                    timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                resp.raise_for_status()
+                draft = await resp.json(content_type=None)
+
+            # Проверяем структуру ответа
+            if 'resData' not in draft or 'id' not in draft['resData']:
+                logger.error("   ✗ Неверный формат ответа API")
+                return {
+                    'docNum': doc_num,
+                    'error': 'Invalid API response format',
+                    'status': 'error'
+                }
+
+            invoice_id = draft['resData']['id']
+            logger.info("   ✓ Черновик создан, ID: %s", invoice_id)
+
+            # Отправляем в розницу
+            logger.info("   Отправка в розницу...")
+            retail_payload = create_retail_payload(invoice_id)
+            await limiter.acquire()
+            async with session.post(url, json=retail_payload,
+                                    timeout=aiohttp.ClientTimeout(total=30)) as retail_resp:
+                retail_resp.raise_for_status()
+
+            logger.info("   ✓ Успешно отправлена в розницу")
+
+            return {
+                'docNum': doc_num,
+                'invoice_id': invoice_id,
+                'items_count': len(inv_payload['opargs']['theCard']['tbrDtoList']),
+                'status': 'created_and_sent',
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            }
+
+        except aiohttp.ClientError as e:
+            logger.error("   ✗ Ошибка сети: %s", e)
+            return {
+                'docNum': doc_num,
+                'error': f"HTTP error: {e}",
+                'status': 'network_error',
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            }
+        except Exception as e:
+            logger.error("   ✗ Ошибка при обработке: %s", e)
+            return {
+                'docNum': doc_num,
+                'error': str(e),
+                'status': 'error',
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            }
+
+
+async def _send_invoices(url: str, headers: Dict, invoices: List[Dict],
+                         concurrency: int, rps: float) -> List[Dict]:
+    """Параллельная отправка накладных: до concurrency цепочек создать→отправить"""
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rps)
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30)
+    results = []
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        tasks = [
+            asyncio.ensure_future(
+                _process_invoice(session, semaphore, limiter, url, idx, len(invoices), inv_payload)
+            )
+            for idx, inv_payload in enumerate(invoices, start=1)
+        ]
+        # as_completed: прогресс в логах появляется по мере завершения, а не в конце
+        for future in asyncio.as_completed(tasks):
+            results.append(await future)
+    return results
+
+
 def run_retail_write_off_service(
     df: pd.DataFrame,
     url: str,
     headers: Dict,
     items_per_invoice: int,
     max_invoices: Optional[int],
-    execute: bool
+    execute: bool,
+    concurrency: int = 8,
+    rps: float = 5.0
 ) -> Tuple[List[Dict], List[Dict]]:
     """
     Единый сервис: подготавливает накладные по FIFO,
     создаёт их в системе и сразу отправляет в розницу.
     """
-    # Сбрасываем счетчик при каждом запуске
-    InvoiceCounter.reset()
-    
     # 1. Формирование накладных
-    print("\n" + "="*60)
-    print("ФОРМИРОВАНИЕ НАКЛАДНЫХ")
-    print("="*60)
+    logger.info("=" * 60)
+    logger.info("ФОРМИРОВАНИЕ НАКЛАДНЫХ")
+    logger.info("=" * 60)
     
     invoices = prepare_invoices(df, items_per_invoice, max_invoices)
     
     if not invoices:
-        print("Нет накладных для обработки")
+        logger.info("Нет накладных для обработки")
         return [], []
     
-    print(f"\n✓ Сформировано {len(invoices)} накладных:")
+    logger.info("✓ Сформировано %d накладных:", len(invoices))
     for i, invoice in enumerate(invoices, 1):
         doc_num = invoice['opargs']['theCard']['head']['docNum']
         items_count = len(invoice['opargs']['theCard']['tbrDtoList'])
         warehouse_id = invoice['opargs']['theCard']['head']['sourceWarehouseId']
         contractor_id = invoice['opargs']['theCard']['head']['receiverContractorId']
-        print(f"  {i:2d}. {doc_num}: {items_count:2d} позиций, "
-              f"склад: {warehouse_id}, контрагент: {contractor_id}")
+        logger.info("  %2d. %s: %2d позиций, склад: %s, контрагент: %s",
+                    i, doc_num, items_count, warehouse_id, contractor_id)
     
     results = []
     if not execute:
-        print("\n" + "="*60)
-        print("ТЕСТИРОВАНИЕ ЗАВЕРШЕНО")
-        print(f"Было бы создано {len(invoices)} накладных")
-        print("Для реальной отправки устанавливаем --execute")
-        print("="*60)
+        logger.info("=" * 60)
+        logger.info("ТЕСТИРОВАНИЕ ЗАВЕРШЕНО")
+        logger.info("Было бы создано %d накладных", len(invoices))
+        logger.info("Для реальной отправки устанавливаем --execute")
+        logger.info("=" * 60)
         return invoices, results
     
     # 2. Создание и отправка
-    print("\n" + "="*60)
-    print("ОТПРАВКА В САТУРН")
-    print("="*60)
-    
-    for idx, inv_payload in enumerate(invoices, start=1):
-        doc_num = inv_payload['opargs']['theCard']['head']['docNum']
-        
-        try:
-            # Создаем накладную в статусе черновик
-            print(f"\n[{idx}/{len(invoices)}] Создание накладной {doc_num}...")
-            print(f"   Позиций: {len(inv_payload['opargs']['theCard']['tbrDtoList'])}")
-            
-            resp = requests.post(url, headers=headers, json=inv_payload, timeout=30)
-            resp.raise_for_status()
-            
-            draft = resp.json()
-            
-            # Проверяем структуру ответа
-            if 'resData' not in draft or 'id' not in draft['resData']:
-                print(f"   ✗ Неверный формат ответа API")
-                results.append({
-                    'docNum': doc_num,
-                    'error': 'Invalid API response format',
-                    'status': 'error'
-                })
-                continue
-                
-            invoice_id = draft['resData']['id']
-            print(f"   ✓ Черновик создан, ID: {invoice_id}")
-            
-            # Отправляем в розницу
-            print(f"   Отправка в розницу...")
-            retail_payload = create_retail_payload(invoice_id)
-            retail_resp = requests.post(url, headers=headers, json=retail_payload, timeout=30)
-            retail_resp.raise_for_status()
-            
-            print(f"   ✓ Успешно отправлена в розницу")
-            
-            results.append({
-                'docNum': doc_num,
-                'invoice_id': invoice_id,
-                'items_count': len(inv_payload['opargs']['theCard']['tbrDtoList']),
-                'status': 'created_and_sent',
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            })
-            
-            # Пауза между запросами
-            if idx < len(invoices):
-                sleep(0.5)
-            
-        except requests.exceptions.RequestException as e:
-            error_msg = f"HTTP error: {e}"
-            print(f"   ✗ Ошибка сети: {e}")
-            results.append({
-                'docNum': doc_num,
-                'error': error_msg,
-                'status': 'network_error',
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            })
-        except Exception as e:
-            print(f"   ✗ Ошибка при обработке: {e}")
-            results.append({
-                'docNum': doc_num,
-                'error': str(e),
-                'status': 'error',
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            })
+    logger.info("=" * 60)
+    logger.info("ОТПРАВКА В САТУРН")
+    logger.info("=" * 60)
     
+    results = asyncio.run(_send_invoices(url, headers, invoices, concurrency, rps))
+
     # Выводим итоги
-    print("\n" + "="*60)
-    print("ИТОГИ ОБРАБОТКИ:")
-    print("="*60)
+    logger.info("=" * 60)
+    logger.info("ИТОГИ ОБРАБОТКИ:")
+    logger.info("=" * 60)
     
     successful = len([r for r in results if r['status'] == 'created_and_sent'])
     failed = len(results) - successful
     
-    print(f"Успешно обработано: {successful}")
-    print(f"Не удалось обработать: {failed}")
+    logger.info("Успешно обработано: %d", successful)
+    logger.info("Не удалось обработать: %d", failed)
     
     if successful > 0:
-        print("\nУспешные накладные:")
+        logger.info("Успешные накладные:")
         for result in results:
             if result['status'] == 'created_and_sent':
-                print(f"  ✓ {result['docNum']} (ID: {result['invoice_id']})")
+                logger.info("  ✓ %s (ID: %s)", result['docNum'], result['invoice_id'])
     
     if failed > 0:
-        print("\nОшибки:")
+        logger.info("Ошибки:")
         for result in results:
             if result['status'] != 'created_and_sent':
-                print(f"  ✗ {result['docNum']}: {result.get('error', 'Unknown error')}")
+                logger.error("  ✗ %s: %s", result['docNum'], result.get('error', 'Unknown error'))
     
-    print("="*60)
+    logger.info("=" * 60)
     
     return invoices, results
 
@@ -387,44 +452,58 @@ def main():
                        help='Максимальное позиций в накладной (по умолчанию: 2)')
     parser.add_argument('--no-limit', action='store_true',
                        help='Без ограничения количества накладных (переопределяет --limit)')
+    parser.add_argument('--stocks-ttl', type=int, default=60,
+                       help='Время жизни кэша остатков в секундах (по умолчанию: 60)')
+    parser.add_argument('--refresh-stocks', action='store_true',
+                       help='Игнорировать кэш и запросить остатки заново')
+    parser.add_argument('--concurrency', type=int, default=8,
+                       help='Число одновременных отправок в САТУРН (по умолчанию: 8)')
+    parser.add_argument('--rps', type=float, default=5.0,
+                       help='Лимит запросов в секунду, 0 — без лимита (по умолчанию: 5)')
     
     args = parser.parse_args()
-    
-    print("Запуск сервиса списания в розницу")
-    print("=" * 60)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)-5s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+    logger.info("Запуск сервиса списания в розницу")
+    logger.info("=" * 60)
     
     # Проверяем конфигурацию
     if not URL or not HEADERS.get('Authorization'):
-        print("Ошибка: не настроены переменные окружения")
-        print(f"URL: {'Установлен' if URL else 'НЕ установлен'}")
-        print(f"Authorization: {'Установлен' if HEADERS.get('Authorization') else 'НЕ установлен'}")
+        logger.error("Ошибка: не настроены переменные окружения")
+        logger.error("URL: %s", 'Установлен' if URL else 'НЕ установлен')
+        logger.error("Authorization: %s", 'Установлен' if HEADERS.get('Authorization') else 'НЕ установлен')
         return
     
     # Получаем данные со склада
-    print("Получение данных об остатках со склада...")
-    df = get_warehouse_stocks(URL, HEADERS)
+    logger.info("Получение данных об остатках со склада...")
+    df = get_warehouse_stocks(URL, HEADERS, ttl=args.stocks_ttl, refresh=args.refresh_stocks)
     
     if df is None:
-        print("Не удалось получить данные от API")
+        logger.error("Не удалось получить данные от API")
         return
     
     if df.empty:
-        print("Нет данных об остатках для обработки")
+        logger.info("Нет данных об остатках для обработки")
         return
     
-    print(f"Получено {len(df)} записей об остатках")
+    logger.info("Получено %d записей об остатках", len(df))
     
     # Определяем лимит накладных
     if args.no_limit:
         max_invoices = None
-        print("Режим: БЕЗ ОГРАНИЧЕНИЯ количества накладных")
+        logger.info("Режим: БЕЗ ОГРАНИЧЕНИЯ количества накладных")
     else:
         max_invoices = args.limit
-        print(f"Лимит накладных: {max_invoices}")
+        logger.info("Лимит накладных: %d", max_invoices)
     
-    print(f"Позиций в накладной: {args.items}")
-    print(f"Режим отправки: {'РЕАЛЬНАЯ ОТПРАВКА' if args.execute else 'ТЕСТИРОВАНИЕ'}")
-    print("=" * 60)
+    logger.info("Позиций в накладной: %d", args.items)
+    logger.info("Режим отправки: %s", 'РЕАЛЬНАЯ ОТПРАВКА' if args.execute else 'ТЕСТИРОВАНИЕ')
+    logger.info("=" * 60)
     
     # Запускаем сервис
     try:
@@ -434,7 +513,9 @@ def main():
             headers=HEADERS,
             items_per_invoice=args.items,
             max_invoices=max_invoices,
-            execute=args.execute
+            execute=args.execute,
+            concurrency=args.concurrency,
+            rps=args.rps
         )
         
         # Сохраняем результаты
@@ -443,27 +524,25 @@ def main():
         try:
             if invoices:
                 invoices_file = f"invoices_{timestamp}.json"
-                with open(invoices_file, 'w', encoding='utf-8') as f:
-                    json.dump(invoices, f, ensure_ascii=False, indent=2)
-                print(f"\n✓ Сформированные накладные сохранены в {invoices_file}")
+                with open(invoices_file, 'wb') as f:
+                    f.write(orjson.dumps(invoices, option=orjson.OPT_INDENT_2))
+                logger.info("✓ Сформированные накладные сохранены в %s", invoices_file)
             
             if results:
                 results_file = f"results_{timestamp}.json"
-                with open(results_file, 'w', encoding='utf-8') as f:
-                    json.dump(results, f, ensure_ascii=False, indent=2)
-                print(f"✓ Результаты обработки сохранены в {results_file}")
+                with open(results_file, 'wb') as f:
+                    f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+                logger.info("✓ Результаты обработки сохранены в %s", results_file)
             
-            print(f"\nЛоги сохранены с префиксом: {timestamp}")
+            logger.info("Логи сохранены с префиксом: %s", timestamp)
                 
         except Exception as e:
-            print(f"\n⚠ Не удалось сохранить файлы: {e}")
+            logger.warning("⚠ Не удалось сохранить файлы: %s", e)
             
     except KeyboardInterrupt:
-        print("\n\nПрервано пользователем")
+        logger.info("Прервано пользователем")
     except Exception as e:
-        print(f"\nОшибка при выполнении сервиса: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Ошибка при выполнении сервиса: %s", e)
 
 
 if __name__ == "__main__":